@@ -2,13 +2,11 @@
 war card game client and server
 """
 import asyncio
-from collections import namedtuple
+from collections import deque, namedtuple
 from enum import Enum
 import logging
 import random
-import socket
 import socketserver
-import threading
 import sys
 """
 Namedtuples work like classes, but are much more lightweight so they end
@@ -17,8 +15,10 @@ for each game which contain the game's state, for instance things like the
 socket, the cards given, the cards still available, etc.
 """
 Game = namedtuple("Game", ["p1", "p2"])
+# A connected client's stream pair
+Player = namedtuple("Player", ["reader", "writer"])
 # Stores the clients waiting to get connected to other clients
-waiting_clients = []
+waiting_clients = deque()
 
 class Command(Enum):
     """
@@ -37,19 +37,31 @@ class Result(Enum):
     DRAW = 1
     LOSE = 2
 
-def readexactly(sock, numbytes):
+# Header byte of a GAMESTART message; the 26-byte hand follows it
+GAMESTART_HDR = bytes([Command.GAMESTART.value])
+
+# Complete PLAYRESULT messages for each player, indexed by
+# compare_cards(p1_card, p2_card) + 1
+P1_RES = tuple(bytes([Command.PLAYRESULT.value, result.value])
+               for result in (Result.LOSE, Result.DRAW, Result.WIN))
+P2_RES = tuple(bytes([Command.PLAYRESULT.value, result.value])
+               for result in (Result.WIN, Result.DRAW, Result.LOSE))
+
+# The unshuffled deck, and the generator used to deal from it. Games all run
+# on one event loop thread, so a single Random instance needs no locking.
+_DECK = bytes(range(52))
+_RNG = random.Random()
+
+async def readexactly(reader, numbytes):
     """
-    Accumulate exactly `numbytes` from `sock` and return those. If EOF is found
-    before numbytes have been received, be sure to account for that here or in
-    the caller.
+    Accumulate exactly `numbytes` from `reader` and return those. If EOF is
+    found before numbytes have been received, the partial data is returned
+    and the caller is responsible for checking its length.
     """
-    data = bytearray()
-    while len(data) < numbytes:
-        packet = sock.recv(numbytes - len(data))
-        if not packet:  # EOF
-            return data
-        data.extend(packet)
-    return data
+    try:
+        return await reader.readexactly(numbytes)
+    except asyncio.IncompleteReadError as e:  # EOF
+        return e.partial
 
 def kill_game(game):
     """
@@ -57,12 +69,12 @@ def kill_game(game):
     """
     logging.info("Killing game between clients")
     try:
-        game.p1.close()
-    except:
+        game.p1.writer.close()
+    except OSError:
         pass
     try:
-        game.p2.close()
-    except:
+        game.p2.writer.close()
+    except OSError:
         pass
 
 def compare_cards(card1, card2):
@@ -79,129 +91,185 @@ def compare_cards(card1, card2):
         return 1
     else:
         return 0
+
+# compare_cards(card1, card2) + 1 for every pair of cards, looked up as
+# CMP[card1 * 52 + card2]; the values index straight into P1_RES/P2_RES
+CMP = bytes(compare_cards(card1, card2) + 1
+            for card1 in range(52) for card2 in range(52))
     
 def deal_cards():
     """
-    Randomize a deck of cards (list of ints 0..51), and return two
-    26 card "hands."
+    Randomize a deck of cards (ints 0..51), and return two 26 card "hands"
+    as bytes, ready to go out in a GAMESTART message.
     """
-    deck = list(range(52))
-    random.shuffle(deck)
-    return deck[:26], deck[26:]
+    deck = bytearray(_DECK)
+    _RNG.shuffle(deck)
+    return bytes(deck[:26]), bytes(deck[26:])
 
-def handle_client_connection(game):
+async def handle_client_connection(game):
     """
     Handle a game between two clients.
     """
-    p1_socket, p2_socket = game.p1, game.p2
+    p1_reader, p1_writer = game.p1
+    p2_reader, p2_writer = game.p2
     
     try:
         p1_cards, p2_cards = deal_cards()
         
-        p1_socket.sendall(bytes([Command.GAMESTART.value]) + bytes(p1_cards))
-        p2_socket.sendall(bytes([Command.GAMESTART.value]) + bytes(p2_cards))
+        # writelines hands header and hand to the transport as separate
+        # buffers; asyncio on 3.12+ sends them in one gathering sendmsg
+        # rather than concatenating first
+        p1_writer.writelines((GAMESTART_HDR, p1_cards))
+        p2_writer.writelines((GAMESTART_HDR, p2_cards))
+        await p1_writer.drain()
+        await p2_writer.drain()
         
-        p1_played_cards = set()
-        p2_played_cards = set()
+        # bit i of a hand mask is set when card i was dealt to that player,
+        # bit i of a played mask once it has been played
+        p1_hand = 0
+        for card in p1_cards:
+            p1_hand |= 1 << card
+        p2_hand = 0
+        for card in p2_cards:
+            p2_hand |= 1 << card
+        p1_played = 0
+        p2_played = 0
         
+        # The round loop reads straight from the StreamReaders, which already
+        # buffer each connection, rather than through readexactly, and
+        # doesn't drain: every result answers a PLAYCARD, so at most 52
+        # bytes can ever queue up per player. Everything it touches is bound
+        # to a local first so each round does no global, enum or method
+        # lookups.
+        playcard = Command.PLAYCARD.value
+        cmp_table, p1_res, p2_res = CMP, P1_RES, P2_RES
+        p1_read, p2_read = p1_reader.readexactly, p2_reader.readexactly
+        p1_write, p2_write = p1_writer.write, p2_writer.write
         for _ in range(26):
-            p1_msg = readexactly(p1_socket, 2)
-            if len(p1_msg) < 2 or p1_msg[0] != Command.PLAYCARD.value:
+            p1_command, p1_card = await p1_read(2)
+            if p1_command != playcard:
                 logging.error("Invalid message from Player 1")
                 kill_game(game)
                 return
             
-            p1_card = p1_msg[1]
-            
-            if p1_card not in p1_cards or p1_card in p1_played_cards:
+            if not (p1_hand >> p1_card) & 1 or (p1_played >> p1_card) & 1:
                 logging.error("Player 1 played invalid card")
                 kill_game(game)
                 return
             
-            p1_played_cards.add(p1_card)
+            p1_played |= 1 << p1_card
             
-            p2_msg = readexactly(p2_socket, 2)
-            if len(p2_msg) < 2 or p2_msg[0] != Command.PLAYCARD.value:
+            p2_command, p2_card = await p2_read(2)
+            if p2_command != playcard:
                 logging.error("Invalid message from Player 2")
                 kill_game(game)
                 return
             
-            p2_card = p2_msg[1]
-            
-            if p2_card not in p2_cards or p2_card in p2_played_cards:
+            if not (p2_hand >> p2_card) & 1 or (p2_played >> p2_card) & 1:
                 logging.error("Player 2 played invalid card")
                 kill_game(game)
                 return
             
-            p2_played_cards.add(p2_card)
-            
-            result = compare_cards(p1_card, p2_card)
+            p2_played |= 1 << p2_card
             
-            if result > 0:  
-                p1_socket.sendall(bytes([Command.PLAYRESULT.value, Result.WIN.value]))
-                p2_socket.sendall(bytes([Command.PLAYRESULT.value, Result.LOSE.value]))
-            elif result < 0: 
-                p1_socket.sendall(bytes([Command.PLAYRESULT.value, Result.LOSE.value]))
-                p2_socket.sendall(bytes([Command.PLAYRESULT.value, Result.WIN.value]))
-            else:  
-                p1_socket.sendall(bytes([Command.PLAYRESULT.value, Result.DRAW.value]))
-                p2_socket.sendall(bytes([Command.PLAYRESULT.value, Result.DRAW.value]))
+            idx = cmp_table[p1_card * 52 + p2_card]
+            p1_write(p1_res[idx])
+            p2_write(p2_res[idx])
         
-        p1_socket.close()
-        p2_socket.close()
+        p1_writer.close()
+        p2_writer.close()
         
+    except asyncio.IncompleteReadError:
+        logging.error("Player disconnected mid-game")
+        kill_game(game)
+    except asyncio.CancelledError:
+        # the server is shutting down
+        kill_game(game)
+        raise
     except Exception as e:
-        logging.error(f"Error in game: {e}")
+        logging.error("Error in game: %s", e)
         kill_game(game)
 
-def serve_game(host, port):
+async def serve_game(host, port):
     """
     Open a socket for listening for new connections on host:port, and
     perform the war protocol to serve a game of war between each client.
     This function should run forever, continually serving clients.
     """
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    
-    server_socket.bind((host, port))
-    
-    server_socket.listen(128) 
-    
-    logging.info(f"War server started on {host}:{port}")
+    # tasks of clients still handshaking or playing, cancelled on shutdown
+    connections = set()
     
-    games = []
-    
-    while True:
-        client_socket, client_address = server_socket.accept()
-        logging.info(f"New connection from {client_address}")
+    async def handle_new_client(reader, writer):
+        """
+        Read WANTGAME from a new client, then either park it until an
+        opponent arrives or play the game against the waiting client.
+        """
+        client_address = writer.get_extra_info("peername")
+        logging.info("New connection from %s", client_address)
         
+        task = asyncio.current_task()
+        connections.add(task)
         try:
-            msg = readexactly(client_socket, 2)
+            msg = await readexactly(reader, 2)
             
             if len(msg) < 2 or msg[0] != Command.WANTGAME.value:
-                logging.error(f"Client {client_address} sent invalid initial message")
-                client_socket.close()
-                continue
+                logging.error("Client %s sent invalid initial message",
+                              client_address)
+                writer.close()
+                return
             
             if not waiting_clients:
-                waiting_clients.append(client_socket)
-                logging.info(f"Client {client_address} waiting for opponent")
+                waiting_clients.append(Player(reader, writer))
+                logging.info("Client %s waiting for opponent", client_address)
             else:
-                opponent_socket = waiting_clients.pop(0)
+                opponent = waiting_clients.popleft()
                 
-                game = Game(opponent_socket, client_socket)
+                game = Game(opponent, Player(reader, writer))
                 
-                game_thread = threading.Thread(target=handle_client_connection, args=(game,))
-                game_thread.daemon = True
-                game_thread.start()
-                
-                games.append(game)
                 logging.info("Game started")
                 
+                # each connection callback already runs as its own task,
+                # so the second player's task plays out the game
+                await handle_client_connection(game)
+                
+        except asyncio.CancelledError:
+            # shutting down; returning rather than re-raising keeps
+            # asyncio from logging the cancelled callback as an error
+            writer.close()
         except Exception as e:
-            logging.error(f"Error handling client: {e}")
-            client_socket.close()
+            logging.error("Error handling client: %s", e)
+            writer.close()
+        finally:
+            connections.discard(task)
+    
+    server = await asyncio.start_server(handle_new_client, host, port,
+                                        backlog=128)
+    
+    logging.info("War server started on %s:%d", host, port)
+    
+    async with server:
+        try:
+            # start_server is already accepting; serve_forever() isn't
+            # used because on cancellation it waits for every connection
+            # to close before the ones below could be closed
+            await asyncio.get_running_loop().create_future()
+        finally:
+            while waiting_clients:
+                waiting_clients.popleft().writer.close()
+            for task in list(connections):
+                task.cancel()
+            if connections:
+                await asyncio.wait(connections)
     
+def run_server(host, port):
+    """
+    Serve games on host:port until the user presses ctrl+c.
+    """
+    try:
+        asyncio.run(serve_game(host, port))
+    except KeyboardInterrupt:
+        pass
+
 async def limit_client(host, port, loop, sem):
     """
     Limit the number of clients currently executing.
@@ -254,11 +322,8 @@ def main(args):
     host = args[1]
     port = int(args[2])
     if args[0] == "server":
-        try:
-            # your server should serve clients until the user presses ctrl+c
-            serve_game(host, port)
-        except KeyboardInterrupt:
-            pass
+        # your server should serve clients until the user presses ctrl+c
+        run_server(host, port)
         return
     else:
         try: